@@ -0,0 +1,102 @@
+import hashlib
+import orjson
+import redis
+import redis.asyncio as aioredis
+
+from .config import settings
+
+redis_client = redis.from_url(settings.REDIS_URL)
+async_redis_client = aioredis.from_url(settings.REDIS_URL)
+
+CACHE_TTL_SECONDS = 86400
+RECOMMENDATION_TTL_SECONDS = 60
+
+
+def _digest(*parts: str) -> str:
+    # JSON-encode the parts so that separators inside them cannot collide.
+    return hashlib.sha256(orjson.dumps(parts)).hexdigest()
+
+
+def quiz_cache_key(source_text: str) -> str:
+    return f"quiz:v1:{hashlib.sha256(source_text.encode()).hexdigest()}"
+
+
+def grade_cache_key(question: str, ideal_answer: str, user_answer: str) -> str:
+    return f"grade:v1:{_digest(question, ideal_answer, user_answer)}"
+
+
+def recommendation_cache_key(user_id: str) -> str:
+    return f"rec:v1:{user_id}"
+
+
+def get_recommendation(user_id: str) -> dict | None:
+    """Returns a user's cached recommendation response, or None on a miss or Redis error."""
+    try:
+        cached = redis_client.get(recommendation_cache_key(user_id))
+    except redis.RedisError as e:
+        print(f"Error reading from cache: {e}")
+        return None
+    return orjson.loads(cached) if cached is not None else None
+
+
+def set_recommendation(user_id: str, response: dict):
+    try:
+        redis_client.set(
+            recommendation_cache_key(user_id),
+            orjson.dumps(response),
+            ex=RECOMMENDATION_TTL_SECONDS,
+        )
+    except redis.RedisError as e:
+        print(f"Error writing to cache: {e}")
+
+
+def invalidate_recommendations(user_ids):
+    """Drops cached recommendations so they reflect updated competence maps."""
+    keys = [recommendation_cache_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    try:
+        redis_client.delete(*keys)
+    except redis.RedisError as e:
+        print(f"Error invalidating cache: {e}")
+
+
+async def get_json(key: str):
+    """Returns the cached value for a key, or None on a miss or Redis error."""
+    try:
+        cached = await async_redis_client.get(key)
+    except redis.RedisError as e:
+        print(f"Error reading from cache: {e}")
+        return None
+    return orjson.loads(cached) if cached is not None else None
+
+
+async def set_json(key: str, value, ttl: int = CACHE_TTL_SECONDS):
+    try:
+        await async_redis_client.set(key, orjson.dumps(value), ex=ttl)
+    except redis.RedisError as e:
+        print(f"Error writing to cache: {e}")
+
+
+async def get_many_json(keys: list[str]) -> list:
+    """Fetches several keys in one round-trip; misses come back as None."""
+    if not keys:
+        return []
+    try:
+        cached = await async_redis_client.mget(keys)
+    except redis.RedisError as e:
+        print(f"Error reading from cache: {e}")
+        return [None] * len(keys)
+    return [orjson.loads(value) if value is not None else None for value in cached]
+
+
+async def set_many_json(values: dict, ttl: int = CACHE_TTL_SECONDS):
+    if not values:
+        return
+    try:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            for key, value in values.items():
+                pipe.set(key, orjson.dumps(value), ex=ttl)
+            await pipe.execute()
+    except redis.RedisError as e:
+        print(f"Error writing to cache: {e}")
@@ -0,0 +1,36 @@
+import os
+import httpx
+import orjson
+
+GEMINI_MODEL = "gemini-1.5-flash"
+GEMINI_URL = (
+    "https://generativelanguage.googleapis.com/v1beta/models/"
+    f"{GEMINI_MODEL}:generateContent"
+)
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Builds the long-lived client used for every Gemini call, so connections
+    (and their TLS handshakes) are reused across requests.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=30,
+        limits=httpx.Limits(max_connections=64),
+        headers={
+            "x-goog-api-key": os.getenv("GOOGLE_API_KEY", ""),
+            "Content-Type": "application/json",
+        },
+    )
+
+
+async def generate_content(client: httpx.AsyncClient, prompt: str) -> str:
+    """Sends a prompt to Gemini's REST API and returns the generated text."""
+    response = await client.post(
+        GEMINI_URL, content=orjson.dumps({"contents": [{"parts": [{"text": prompt}]}]})
+    )
+    response.raise_for_status()
+
+    candidate = orjson.loads(response.content)["candidates"][0]
+    return "".join(part.get("text", "") for part in candidate["content"]["parts"])
@@ -1,23 +1,36 @@
 import os
-import json
-from fastapi import FastAPI, Depends, HTTPException, Header, BackgroundTasks
+import re
+import orjson
+import asyncio
+from contextlib import asynccontextmanager
+import httpx
+from fastapi import FastAPI, Depends, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-import google.generativeai.client as genai
-from google.generativeai.generative_models import GenerativeModel
 
-from . import schemas, models, database, config
+from . import schemas, models, database, config, cache, gemini
 from report_generator.generate import generate_report_for_user
-
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-model = GenerativeModel("gemini-1.5-flash")
+from report_generator.worker import report_queue
 
 models.Base.metadata.create_all(bind=database.engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Shares one pooled HTTP client for Gemini calls across all requests."""
+    app.state.http = gemini.create_http_client()
+    yield
+    await app.state.http.aclose()
+
+
 app = FastAPI(
     title="Personalized Learning Engine",
     description="Provides real-time recommendations and AI-powered assessments.",
     version="2.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -35,6 +48,124 @@ async def verify_api_key(x_internal_api_key: str = Header(...)):
         raise HTTPException(status_code=401, detail="Invalid Internal API Key")
 
 
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    """A dependency returning the application's shared HTTP client."""
+    return request.app.state.http
+
+
+# The quiz prompt is constant apart from the source text, so it is built once.
+_QUIZ_PROMPT_PREFIX = """
+    Based on the following text, generate a 5-question quiz to test understanding.
+    The quiz must include 3 multiple-choice questions and 2 short-answer (open-ended) questions.
+    For multiple-choice questions, provide 4 options and indicate the correct answer.
+    For short-answer questions, provide an ideal answer for evaluation.
+    Provide a relevant hint for every question.
+
+    Respond ONLY with a valid JSON object following this structure, with no markdown formatting:
+    {
+      "questions": [
+        { "type": "multiple-choice", "question": "...", "options": ["...", "...", "...", "..."], "answer": "...", "hint": "..." },
+        { "type": "short-answer", "question": "...", "answer": "...", "hint": "..." }
+      ]
+    }
+
+    Source Text:
+    ---
+    """
+_QUIZ_PROMPT_SUFFIX = """
+    ---
+    """
+
+
+# Matches an opening ```/```json fence at the start or a closing fence at the end.
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
+def _strip_code_fence(text: str) -> str:
+    """Removes the markdown code fence Gemini sometimes wraps JSON output in."""
+    return _FENCE_RE.sub("", text)
+
+
+def _build_short_answer_prompt(question: str, ideal_answer: str, user_answer: str) -> str:
+    return f"""
+    A user was asked the following question:
+    '{question}'
+
+    The ideal answer is:
+    '{ideal_answer}'
+
+    The user's answer was:
+    '{user_answer}'
+
+    Based on the ideal answer, is the user's answer correct? The user's answer should capture the main idea but does not need to be a word-for-word match.
+    Respond ONLY with the single word "true" if the answer is correct or "false" if it is incorrect.
+    """
+
+
+async def _grade_short_answers_individually(
+    http: httpx.AsyncClient, items: list[dict]
+) -> list[bool | None]:
+    """
+    Grades each short answer with its own Gemini call, run concurrently.
+    Answers that could not be evaluated are returned as None.
+    """
+    responses = await asyncio.gather(
+        *(
+            gemini.generate_content(
+                http,
+                _build_short_answer_prompt(item["question"], item["ideal"], item["user"]),
+            )
+            for item in items
+        ),
+        return_exceptions=True,
+    )
+    grades = []
+    for response in responses:
+        try:
+            if isinstance(response, Exception):
+                raise response
+            grades.append(response.strip().lower() == "true")
+        except Exception as e:
+            print(f"Error evaluating answer with Gemini: {e}")
+            grades.append(None)
+    return grades
+
+
+async def _grade_short_answers(
+    http: httpx.AsyncClient, items: list[dict]
+) -> list[bool | None]:
+    """
+    Grades all short answers with a single Gemini call that returns a JSON
+    array of booleans. Falls back to one call per answer if the batched
+    response cannot be parsed or does not line up with the questions.
+    """
+    prompt = f"""
+    A user answered the following short-answer questions. Each item contains the
+    question, the ideal answer and the user's answer.
+
+    {orjson.dumps(items, option=orjson.OPT_INDENT_2).decode()}
+
+    For each item, decide whether the user's answer is correct based on the ideal answer.
+    The user's answer should capture the main idea but does not need to be a word-for-word match.
+    Respond ONLY with a JSON array of exactly {len(items)} booleans (true or false), one per item
+    in the same order, with no markdown formatting.
+    """
+    try:
+        response_text = await gemini.generate_content(http, prompt)
+        grades = schemas.ShortAnswerGrades.model_validate(
+            orjson.loads(_strip_code_fence(response_text))
+        ).root
+        if len(grades) == len(items):
+            return grades
+        print(
+            f"Batched evaluation returned {len(grades)} grades for {len(items)} answers"
+        )
+    except Exception as e:
+        print(f"Error batch evaluating answers with Gemini: {e}")
+
+    return await _grade_short_answers_individually(http, items)
+
+
 # --- API Endpoints ---
 @app.get("/")
 def read_root():
@@ -43,7 +174,10 @@ def read_root():
 
 
 @app.post("/quiz/generate", dependencies=[Depends(verify_api_key)])
-def generate_quiz(request: schemas.QuizGenerationRequest):
+async def generate_quiz(
+    request: schemas.QuizGenerationRequest,
+    http: httpx.AsyncClient = Depends(get_http_client),
+):
     """
     Generates a quiz for a given piece of content using the Gemini API.
     """
@@ -53,31 +187,18 @@ def generate_quiz(request: schemas.QuizGenerationRequest):
             detail="Source text is too short to generate a meaningful quiz.",
         )
 
-    prompt = f"""
-    Based on the following text, generate a 5-question quiz to test understanding.
-    The quiz must include 3 multiple-choice questions and 2 short-answer (open-ended) questions.
-    For multiple-choice questions, provide 4 options and indicate the correct answer.
-    For short-answer questions, provide an ideal answer for evaluation.
-    Provide a relevant hint for every question.
+    cache_key = cache.quiz_cache_key(request.source_text)
+    cached_quiz = await cache.get_json(cache_key)
+    if cached_quiz is not None:
+        return cached_quiz
 
-    Respond ONLY with a valid JSON object following this structure, with no markdown formatting:
-    {{
-      "questions": [
-        {{ "type": "multiple-choice", "question": "...", "options": ["...", "...", "...", "..."], "answer": "...", "hint": "..." }},
-        {{ "type": "short-answer", "question": "...", "answer": "...", "hint": "..." }}
-      ]
-    }}
-
-    Source Text:
-    ---
-    {request.source_text}
-    ---
-    """
+    prompt = f"{_QUIZ_PROMPT_PREFIX}{request.source_text}{_QUIZ_PROMPT_SUFFIX}"
     try:
-        response = model.generate_content(prompt)
+        response_text = await gemini.generate_content(http, prompt)
         # Clean the response to ensure it is valid JSON before parsing
-        cleaned_text = response.text.strip().lstrip("```json").rstrip("```")
-        json_response = json.loads(cleaned_text)
+        cleaned_text = _strip_code_fence(response_text)
+        json_response = orjson.loads(cleaned_text)
+        await cache.set_json(cache_key, json_response)
         return json_response
     except Exception as e:
         print(f"Error generating quiz from Gemini: {e}")
@@ -87,13 +208,17 @@ def generate_quiz(request: schemas.QuizGenerationRequest):
 
 
 @app.post("/quiz/evaluate", dependencies=[Depends(verify_api_key)])
-def evaluate_quiz_answers(request: schemas.QuizEvaluationRequest):
+async def evaluate_quiz_answers(
+    request: schemas.QuizEvaluationRequest,
+    http: httpx.AsyncClient = Depends(get_http_client),
+):
     """
     Evaluates a user's answers, especially open-ended ones, using the Gemini API.
+    All short-answer questions are graded together in a single request.
     """
     total_questions = len(request.questions)
-    correct_answers = 0
     results = []
+    short_answers = []
 
     for i, question_data in enumerate(request.questions):
         user_answer = request.userAnswers[i]
@@ -104,36 +229,86 @@ def evaluate_quiz_answers(request: schemas.QuizEvaluationRequest):
                 user_answer.strip().lower() == question_data.answer.strip().lower()
             )
         elif question_data.type == "short-answer":
-            prompt = f"""
-            A user was asked the following question:
-            '{question_data.question}'
-
-            The ideal answer is:
-            '{question_data.answer}'
-
-            The user's answer was:
-            '{user_answer}'
-
-            Based on the ideal answer, is the user's answer correct? The user's answer should capture the main idea but does not need to be a word-for-word match.
-            Respond ONLY with the single word "true" if the answer is correct or "false" if it is incorrect.
-            """
-            try:
-                response = model.generate_content(prompt)
-                is_correct = response.text.strip().lower() == "true"
-            except Exception as e:
-                print(f"Error evaluating answer with Gemini: {e}")
-                is_correct = False
-
-        if is_correct:
-            correct_answers += 1
+            short_answers.append(
+                (
+                    i,
+                    {
+                        "question": question_data.question,
+                        "ideal": question_data.answer,
+                        "user": user_answer,
+                    },
+                )
+            )
 
         results.append({"questionIndex": i, "isCorrect": is_correct})
 
+    # Reuse cached verdicts and only send the remaining answers to Gemini.
+    cache_keys = [
+        cache.grade_cache_key(item["question"], item["ideal"], item["user"])
+        for _, item in short_answers
+    ]
+    cached_grades = await cache.get_many_json(cache_keys)
+    ungraded = [
+        (i, item, key)
+        for (i, item), key, grade in zip(short_answers, cache_keys, cached_grades)
+        if grade is None
+    ]
+    for (i, _), grade in zip(short_answers, cached_grades):
+        if grade is not None:
+            results[i]["isCorrect"] = grade
+
+    if ungraded:
+        grades = await _grade_short_answers(http, [item for _, item, _ in ungraded])
+        for (i, _, _), grade in zip(ungraded, grades):
+            results[i]["isCorrect"] = bool(grade)
+        await cache.set_many_json(
+            {
+                key: grade
+                for (_, _, key), grade in zip(ungraded, grades)
+                if grade is not None
+            }
+        )
+
+    correct_answers = sum(1 for result in results if result["isCorrect"])
     score = correct_answers / total_questions
     return {"score": score, "results": results}
 
 
 # --- Existing Endpoints ---
+MASTERY_THRESHOLD = 0.90
+
+# Finds the concept with the lowest competence score below the mastery
+# threshold, plus a ContentNode teaching it. This assumes `contentJson`
+# contains `{"conceptId": "..."}`.
+_WEAKEST_CONCEPT_SQL = text(
+    """
+    WITH profile AS (
+        SELECT "competenceMap" AS competence_map
+        FROM "LearnerProfile"
+        WHERE "userId" = :user_id
+    ),
+    weakest AS (
+        SELECT key AS concept_id
+        FROM profile, jsonb_each_text(profile.competence_map)
+        WHERE value::float < :mastery_threshold
+        ORDER BY value::float ASC
+        LIMIT 1
+    )
+    SELECT
+        EXISTS (
+            SELECT 1 FROM profile WHERE competence_map <> '{}'::jsonb
+        ) AS has_profile,
+        (SELECT concept_id FROM weakest) AS concept_id,
+        (
+            SELECT c.id
+            FROM "ContentNode" c, weakest w
+            WHERE c."contentJson"->>'conceptId' = w.concept_id
+            LIMIT 1
+        ) AS content_node_id
+    """
+)
+
+
 @app.post(
     "/recommend",
     response_model=schemas.RecommendationResponse,
@@ -146,49 +321,35 @@ def get_recommendation(
     Intelligent recommendation logic.
     Finds the concept with the lowest mastery and recommends content for it.
     """
-    # 1. Fetch the user's learner profile.
-    profile = (
-        db.query(models.LearnerProfile)
-        .filter(models.LearnerProfile.userId == request.userId)
-        .first()
-    )
-
-    if not profile or not profile.competenceMap:
+    cached_recommendation = cache.get_recommendation(request.userId)
+    if cached_recommendation is not None:
+        return cached_recommendation
+
+    # Postgres picks the weakest unmastered concept and a ContentNode that
+    # teaches it in a single round-trip.
+    row = db.execute(
+        _WEAKEST_CONCEPT_SQL,
+        {"user_id": request.userId, "mastery_threshold": MASTERY_THRESHOLD},
+    ).one()
+
+    if not row.has_profile:
         raise HTTPException(
             status_code=404, detail="Learner profile not found or is empty."
         )
 
-    # 2. Find the concept with the lowest competence score below a mastery threshold.
-    competence_map = profile.competenceMap
-    mastery_threshold = 0.90
-
-    # Filter out mastered concepts and sort by score
-    weakest_concepts = sorted(
-        [item for item in competence_map.items() if item[1] < mastery_threshold],
-        key=lambda item: item[1],
-    )
-
-    if not weakest_concepts:
+    if row.concept_id is None:
         # User has mastered everything, maybe recommend a final exam or new topic.
         # For now, we'll indicate no specific content is needed.
-        return {"contentNodeId": None}
-
-    target_concept_id = weakest_concepts[0][0]
-
-    # 3. Find a ContentNode that teaches this specific concept.
-    # This assumes `contentJson` contains `{"conceptId": "..."}`.
-    recommended_node = (
-        db.query(models.ContentNode)
-        .filter(models.ContentNode.contentJson["conceptId"].astext == target_concept_id)
-        .first()
-    )
-
-    if not recommended_node:
+        recommendation = {"contentNodeId": None}
+    elif row.content_node_id is None:
         raise HTTPException(
-            status_code=404, detail=f"No content found for concept: {target_concept_id}"
+            status_code=404, detail=f"No content found for concept: {row.concept_id}"
         )
+    else:
+        recommendation = {"contentNodeId": row.content_node_id}
 
-    return {"contentNodeId": recommended_node.id}
+    cache.set_recommendation(request.userId, recommendation)
+    return recommendation
 
 
 @app.post(
@@ -196,13 +357,28 @@ def get_recommendation(
     status_code=202,
     dependencies=[Depends(verify_api_key)],
 )
-async def trigger_report_generation(
-    request: schemas.RecommendationRequest,
-    background_tasks: BackgroundTasks,
-):
+def trigger_report_generation(request: schemas.RecommendationRequest):
     """
-    Triggers a report generation job for a specific user as a background task.
+    Queues a report generation job for a specific user. The job runs in a
+    separate report worker process, keeping the heavy work off the API.
     """
-    background_tasks.add_task(generate_report_for_user, request.userId)
+    report_queue.enqueue(generate_report_for_user, request.userId)
 
     return {"message": "Report generation has been queued."}
+
+
+if __name__ == "__main__":
+    # To run the API: python -m decision_engine.main
+    # Runs one process per CPU core (override with WEB_CONCURRENCY); the "auto"
+    # loop and httptools parser use uvloop wherever it is installed.
+    import uvicorn
+
+    uvicorn.run(
+        "decision_engine.main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        loop="auto",
+        http="httptools",
+        timeout_keep_alive=30,
+    )
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, DateTime, Float, ForeignKey, JSON
+from sqlalchemy import Column, String, DateTime, Float, ForeignKey, Index, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from .database import Base
 import datetime
@@ -8,7 +9,7 @@ class ContentNode(Base):
     __tablename__ = "ContentNode"
     id = Column(String, primary_key=True, index=True)
     createdAt = Column(DateTime, default=datetime.datetime.utcnow)
-    contentJson = Column(JSON)
+    contentJson = Column(JSONB)
 
 
 class UserInteraction(Base):
@@ -25,4 +26,23 @@ class LearnerProfile(Base):
     id = Column(String, primary_key=True, index=True)
     userId = Column(String, unique=True, index=True)
     engagementScore = Column(Float, default=0.5)
-    competenceMap = Column(JSON, nullable=False)
+    competenceMap = Column(JSONB, nullable=False)
+
+
+class LearnerReport(Base):
+    __tablename__ = "LearnerReport"
+    id = Column(String, primary_key=True)
+    userId = Column(String, index=True)
+    generatedAt = Column(DateTime, default=datetime.datetime.utcnow)
+    reportData = Column(JSON)
+
+
+# Expression index for recommendation lookups by `contentJson->>'conceptId'`.
+Index("ix_contentnode_conceptid", ContentNode.contentJson["conceptId"].astext)
+
+# Recent-activity counts per user in the report job.
+Index(
+    "ix_userinteraction_userid_createdat",
+    UserInteraction.userId,
+    UserInteraction.createdAt,
+)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, RootModel
 from typing import List
 
 
@@ -31,3 +31,7 @@ class QuizEvaluationRequest(BaseModel):
 
     questions: List[Question]
     userAnswers: List[str]
+
+
+class ShortAnswerGrades(RootModel[List[bool]]):
+    """Per-question verdicts returned by a batched short-answer evaluation."""
@@ -0,0 +1,13 @@
+-- JSONB columns and indexes for JSON lookups on the recommendation path.
+-- `create_all` only builds these for fresh tables and never alters existing
+-- ones, so run this once against existing databases. The column conversions
+-- rewrite their tables; CONCURRENTLY cannot run inside a transaction block.
+
+ALTER TABLE "LearnerProfile"
+    ALTER COLUMN "competenceMap" TYPE jsonb USING "competenceMap"::jsonb;
+
+ALTER TABLE "ContentNode"
+    ALTER COLUMN "contentJson" TYPE jsonb USING "contentJson"::jsonb;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_contentnode_conceptid
+    ON "ContentNode" (("contentJson" ->> 'conceptId'));
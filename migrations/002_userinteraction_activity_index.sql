@@ -0,0 +1,5 @@
+-- Composite index for the weekly report's per-user activity counts.
+-- CONCURRENTLY cannot run inside a transaction block.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_userinteraction_userid_createdat
+    ON "UserInteraction" ("userId", "createdAt");
@@ -1,20 +1,56 @@
-import json
-from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
+from sqlalchemy import insert, text
+from ulid import ULID
 
 from decision_engine.database import SessionLocal
-from decision_engine.models import LearnerProfile, UserInteraction
-
-from sqlalchemy import Column, String, DateTime, JSON, ForeignKey
-from decision_engine.database import Base
-
-
-class LearnerReport(Base):
-    __tablename__ = "LearnerReport"
-    id = Column(String, primary_key=True)
-    userId = Column(String, index=True)
-    generatedAt = Column(DateTime, default=datetime.utcnow)
-    reportData = Column(JSON)
+from decision_engine.models import LearnerReport
+
+
+REPORT_BATCH_SIZE = 1000
+STRENGTH_THRESHOLD = 0.90
+WEAKNESS_THRESHOLD = 0.60
+
+# Returns each profile with its strengths and weaknesses already classified
+# by Postgres, plus its number of interactions since `:since`.
+_REPORT_ROWS_SQL = """
+    SELECT
+        lp."userId" AS user_id,
+        lp."engagementScore" AS engagement_score,
+        concepts.concept_count,
+        concepts.strengths,
+        concepts.weaknesses,
+        COALESCE(activity.interaction_count, 0) AS recent_activity_count
+    FROM "LearnerProfile" lp
+    CROSS JOIN LATERAL (
+        SELECT
+            count(*) AS concept_count,
+            COALESCE(
+                array_agg(key) FILTER (WHERE value::float >= :strength_threshold),
+                '{}'
+            ) AS strengths,
+            COALESCE(
+                array_agg(key) FILTER (WHERE value::float < :weakness_threshold),
+                '{}'
+            ) AS weaknesses
+        FROM jsonb_each_text(lp."competenceMap")
+    ) concepts
+    LEFT JOIN (
+        SELECT "userId", count(*) AS interaction_count
+        FROM "UserInteraction"
+        WHERE "createdAt" >= :since
+        GROUP BY "userId"
+    ) activity ON activity."userId" = lp."userId"
+"""
+_ALL_REPORT_ROWS_SQL = text(_REPORT_ROWS_SQL)
+_USER_REPORT_ROWS_SQL = text(_REPORT_ROWS_SQL + 'WHERE lp."userId" = :user_id')
+
+
+def _report_query_params() -> dict:
+    return {
+        "strength_threshold": STRENGTH_THRESHOLD,
+        "weakness_threshold": WEAKNESS_THRESHOLD,
+        "since": datetime.utcnow() - timedelta(days=7),
+    }
 
 
 def generate_reports_for_all_users():
@@ -25,117 +61,96 @@ def generate_reports_for_all_users():
     try:
         print("Starting weekly report generation job...")
 
-        # Get all user profiles
-        profiles = db.query(LearnerProfile).all()
-
-        for profile in profiles:
-            print(f"Generating report for user: {profile.userId}")
-
-            # 1. Analyze competence map for strengths and weaknesses
-            competence_map = profile.competenceMap
-            if not competence_map:
-                continue
-
-            strengths = [
-                concept for concept, score in competence_map.items() if score >= 0.90
-            ]
-            weaknesses = [
-                concept for concept, score in competence_map.items() if score < 0.60
-            ]
-
-            # 2. Calculate activity in the last 7 days
-            one_week_ago = datetime.utcnow() - timedelta(days=7)
-            recent_activity_count = (
-                db.query(UserInteraction)
-                .filter(
-                    UserInteraction.userId == profile.userId,
-                    UserInteraction.createdAt >= one_week_ago,
+        # Stream profiles from a server-side cursor and insert reports in
+        # chunks, so memory stays flat regardless of the number of users.
+        rows = db.execute(
+            _ALL_REPORT_ROWS_SQL,
+            _report_query_params(),
+            execution_options={"yield_per": REPORT_BATCH_SIZE},
+        )
+        pending_reports = []
+        profile_count = 0
+
+        with db.no_autoflush:
+            for row in rows:
+                profile_count += 1
+                print(f"Generating report for user: {row.user_id}")
+
+                # 1. Skip profiles without any assessed concepts
+                if not row.concept_count:
+                    continue
+
+                # 2. Construct the report data
+                report_data = {
+                    "summary": f"You completed {row.recent_activity_count} activities this week. Great job!",
+                    "strengths": row.strengths,
+                    "weaknesses": row.weaknesses,
+                    "engagementScore": row.engagement_score,
+                    "generatedOn": datetime.utcnow().isoformat(),
+                }
+
+                # 3. Queue the new report for a bulk insert
+                pending_reports.append(
+                    {
+                        "id": f"rep_{ULID()}",
+                        "userId": row.user_id,
+                        "reportData": report_data,
+                    }
                 )
-                .count()
-            )
+                if len(pending_reports) >= REPORT_BATCH_SIZE:
+                    db.execute(insert(LearnerReport), pending_reports)
+                    pending_reports.clear()
 
-            # 3. Construct the report data
-            report_data = {
-                "summary": f"You completed {recent_activity_count} activities this week. Great job!",
-                "strengths": strengths,
-                "weaknesses": weaknesses,
-                "engagementScore": profile.engagementScore,
-                "generatedOn": datetime.utcnow().isoformat(),
-            }
-
-            # 4. Save the new report to the database
-            new_report = LearnerReport(
-                id=f"rep_{profile.userId}_{datetime.utcnow().timestamp()}",
-                userId=profile.userId,
-                reportData=report_data,
-            )
-            db.add(new_report)
+            if pending_reports:
+                db.execute(insert(LearnerReport), pending_reports)
 
+        # Committing mid-stream would close the server-side cursor, so the
+        # reports are committed together once every profile has been read.
         db.commit()
-        print(f"Successfully generated reports for {len(profiles)} users.")
+        print(f"Successfully generated reports for {profile_count} users.")
 
     finally:
         db.close()
 
 
-if __name__ == "__main__":
-    # To run this job: python -m report_generator.generate
-    generate_reports_for_all_users()
-
-
 def generate_report_for_user(user_id: str):
     """Generates a performance report for a single user."""
     db = SessionLocal()
     try:
         print(f"Generating report for user: {user_id}")
-        profile = (
-            db.query(LearnerProfile).filter(LearnerProfile.userId == user_id).first()
-        )
-        if not profile:
+        row = db.execute(
+            _USER_REPORT_ROWS_SQL, {**_report_query_params(), "user_id": user_id}
+        ).first()
+        if not row:
             print(f"Cannot generate report: Profile not found for user {user_id}")
             return
 
-        competence_map = profile.competenceMap
-        if not competence_map:
+        if not row.concept_count:
             return
 
-        strengths = [
-            concept for concept, score in competence_map.items() if score >= 0.90
-        ]
-        weaknesses = [
-            concept for concept, score in competence_map.items() if score < 0.60
-        ]
-
-        one_week_ago = datetime.utcnow() - timedelta(days=7)
-        recent_activity_count = (
-            db.query(UserInteraction)
-            .filter(
-                UserInteraction.userId == profile.userId,
-                UserInteraction.createdAt >= one_week_ago,
-            )
-            .count()
-        )
+        strengths, weaknesses = row.strengths, row.weaknesses
 
         # Detailed data for paid users
         detailed_analysis = {"misconception_patterns": ["some_deep_insight"]}
 
         # Summary data for free users
-        summary_analysis = f"You completed {recent_activity_count} activities this week. Your key strengths are in {', '.join(strengths[:2])}."
+        summary_analysis = f"You completed {row.recent_activity_count} activities this week. Your key strengths are in {', '.join(strengths[:2])}."
 
         report_data = {
             "summary": summary_analysis,
             "details": detailed_analysis,  # This part is for paid users
             "strengths": strengths,
             "weaknesses": weaknesses,
-            "engagementScore": profile.engagementScore,
+            "engagementScore": row.engagement_score,
         }
 
-        new_report = LearnerReport(
-            id=f"rep_{profile.userId}_{datetime.utcnow().timestamp()}",
-            userId=profile.userId,
-            reportData=report_data,
+        db.execute(
+            insert(LearnerReport).values(
+                id=f"rep_{ULID()}",
+                userId=row.user_id,
+                reportData=report_data,
+            )
         )
-        db.add(new_report)
         db.commit()
         print(f"Successfully generated report for user: {user_id}")
 
@@ -143,3 +158,8 @@ def generate_report_for_user(user_id: str):
 
     finally:
         db.close()
+
+
+if __name__ == "__main__":
+    # To run this job: python -m report_generator.generate
+    generate_reports_for_all_users()
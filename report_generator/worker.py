@@ -0,0 +1,19 @@
+from rq import Queue, Worker
+from decision_engine.cache import redis_client
+
+REPORT_QUEUE_NAME = "reports"
+report_queue = Queue(REPORT_QUEUE_NAME, connection=redis_client)
+
+
+def main():
+    """
+    Runs a worker that executes queued report jobs one at a time.
+    Scale throughput by starting more worker processes.
+    """
+    print("Starting Report Worker...")
+    Worker([report_queue], connection=redis_client).work()
+
+
+if __name__ == "__main__":
+    # To run this worker: python -m report_generator.worker
+    main()
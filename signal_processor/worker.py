@@ -1,78 +1,198 @@
-import json
-import time
+import orjson
 import redis
+import time
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
+from decision_engine.cache import redis_client, invalidate_recommendations
 from decision_engine.database import SessionLocal
-from decision_engine.models import LearnerProfile
-from decision_engine.config import settings
 
-redis_client = redis.from_url(settings.DATABASE_URL)
 INTERACTION_QUEUE_KEY = "interaction-queue"
+# Messages that could not be applied are parked here instead of being dropped.
+FAILED_QUEUE_KEY = "interaction-queue:failed"
+BATCH_SIZE = 128
+
+# Bayesian Knowledge Tracing parameters.
+PROB_LEARN, PROB_SLIP, PROB_GUESS = 0.10, 0.15, 0.25
+DEFAULT_PROB_KNOW = 0.1
+
 
+def parse_quiz_attempt(event: dict):
+    """Returns (user_id, concept_id, is_correct) for valid quiz attempts, else None."""
+    if not isinstance(event, dict):
+        print(f"Skipping invalid event: {event}")
+        return None
 
-def process_interaction_event(db: Session, event: dict):
-    # This logic remains the same
     if event.get("interactionType") != "QUIZ_ATTEMPT":
-        return
+        return None
 
     user_id = event.get("userId")
-    data = event.get("data", {})
+    data = event.get("data")
+    if not isinstance(data, dict):
+        print(f"Skipping invalid event: {event}")
+        return None
+
     concept_id = data.get("conceptId")
     is_correct = data.get("isCorrect")
 
     if not all([user_id, concept_id, is_correct is not None]):
         print(f"Skipping invalid event: {event}")
-        return
+        return None
 
-    profile = db.query(LearnerProfile).filter(LearnerProfile.userId == user_id).first()
-    if not profile:
-        print(f"Profile not found for user {user_id}")
-        return
+    return user_id, concept_id, is_correct
 
-    prob_learn, prob_slip, prob_guess = 0.10, 0.15, 0.25
-    current_prob_know = profile.competenceMap.get(concept_id, 0.1)
 
-    if is_correct:
-        prob_know_if_correct = (current_prob_know * (1 - prob_slip)) / (
-            (current_prob_know * (1 - prob_slip)) + (1 - current_prob_know) * prob_guess
-        )
-        updated_prob_know = (
-            prob_know_if_correct + (1 - prob_know_if_correct) * prob_learn
-        )
-    else:
-        prob_know_if_incorrect = (current_prob_know * prob_slip) / (
-            (current_prob_know * prob_slip) + (1 - current_prob_know) * (1 - prob_guess)
-        )
-        updated_prob_know = (
-            prob_know_if_incorrect + (1 - prob_know_if_incorrect) * prob_learn
+# The prior for a concept the learner has not attempted yet.
+_PRIOR = """COALESCE(("competenceMap" ->> :concept_id)::float, :default_prob_know)"""
+
+# Applies one Bayesian Knowledge Tracing step to a single concept inside
+# Postgres, so the profile is never loaded and only that key is rewritten.
+# The statement reads the prior from the row it locks, which keeps concurrent
+# updates for the same user from overwriting each other.
+_UPDATE_COMPETENCE_SQL = text(
+    f"""
+    UPDATE "LearnerProfile"
+    SET "competenceMap" = jsonb_set(
+        "competenceMap",
+        ARRAY[:concept_id],
+        to_jsonb(round((
+            :prob_learn + (1 - :prob_learn) * ({_PRIOR} * :likelihood_if_known)
+            / ({_PRIOR} * :likelihood_if_known + (1 - {_PRIOR}) * :likelihood_if_unknown)
+        )::numeric, 4))
+    )
+    WHERE "userId" = :user_id
+    RETURNING ("competenceMap" ->> :concept_id)::float AS prob_know
+    """
+)
+
+
+def _apply_attempt(db: Session, user_id: str, concept_id: str, is_correct: bool):
+    """Runs the BKT update for one attempt; returns None if the user has no profile."""
+    # A correct and an incorrect answer share the same Bayes update; only
+    # the likelihood of the observed answer under each hypothesis differs.
+    likelihood_if_known = (1 - PROB_SLIP) if is_correct else PROB_SLIP
+    likelihood_if_unknown = PROB_GUESS if is_correct else (1 - PROB_GUESS)
+
+    return db.execute(
+        _UPDATE_COMPETENCE_SQL,
+        {
+            "user_id": user_id,
+            "concept_id": concept_id,
+            "default_prob_know": DEFAULT_PROB_KNOW,
+            "prob_learn": PROB_LEARN,
+            "likelihood_if_known": likelihood_if_known,
+            "likelihood_if_unknown": likelihood_if_unknown,
+        },
+    ).scalar()
+
+
+def _apply_attempts_one_by_one(db: Session, attempts: list[tuple]):
+    """
+    Replays a batch whose update failed with a savepoint around each event, so
+    a bad event is rolled back on its own. Returns the results of the events
+    that were applied and the events that failed.
+    """
+    results = []
+    failed_events = []
+    for event, attempt in attempts:
+        try:
+            with db.begin_nested():
+                results.append((attempt, _apply_attempt(db, *attempt)))
+        except SQLAlchemyError as e:
+            print(f"Failed to apply event for user {attempt[0]}: {e}")
+            failed_events.append(event)
+    return results, failed_events
+
+
+def process_interaction_events(db: Session, events: list[dict]) -> list[dict]:
+    """
+    Applies a batch of events to the learner profiles they touch in a single
+    transaction. Events are applied in queue order, so repeated attempts on
+    the same concept build on each other exactly as they would one at a time.
+    Returns the events whose update failed so the caller can park them.
+    """
+    attempts = []
+    for event in events:
+        attempt = parse_quiz_attempt(event)
+        if attempt:
+            attempts.append((event, attempt))
+
+    try:
+        results = [(attempt, _apply_attempt(db, *attempt)) for _, attempt in attempts]
+        failed_events = []
+    except SQLAlchemyError as e:
+        # Savepoints cost two extra round-trips per event, so they are only
+        # used to isolate the bad events once the plain batch has failed.
+        print(f"Batch update failed, retrying events one at a time: {e}")
+        db.rollback()
+        results, failed_events = _apply_attempts_one_by_one(db, attempts)
+
+    updated_user_ids = set()
+    for (user_id, concept_id, _), updated_prob_know in results:
+        if updated_prob_know is None:
+            print(f"Profile not found for user {user_id}")
+            continue
+
+        updated_user_ids.add(user_id)
+        print(
+            f"Updated competence for user {user_id}, concept {concept_id}: {updated_prob_know:.4f}"
         )
 
-    profile.competenceMap[concept_id] = round(updated_prob_know, 4)
     db.commit()
-    print(
-        f"Updated competence for user {user_id}, concept {concept_id}: {updated_prob_know:.4f}"
-    )
+    invalidate_recommendations(updated_user_ids)
+    return failed_events
+
+
+def park_messages(messages: list[bytes]):
+    """Moves messages that could not be applied to the failed queue for replay."""
+    if not messages:
+        return
+    try:
+        redis_client.lpush(FAILED_QUEUE_KEY, *messages)
+        print(f"Moved {len(messages)} messages to {FAILED_QUEUE_KEY}")
+    except redis.RedisError as e:
+        print(f"Error moving {len(messages)} messages to {FAILED_QUEUE_KEY}: {e}")
 
 
 def main():
-    """Main worker loop to process messages from the Redis queue."""
+    """
+    Main worker loop to process messages from the Redis queue.
+    Several worker processes can consume the same queue: every message is
+    popped atomically by exactly one of them.
+    """
     print("Starting Signal Processor Worker...")
     while True:
         db = SessionLocal()
+        decoded_messages = []
         try:
-            # --- CHANGE: Use blocking pop from Redis ---
-            # BRPOP efficiently waits for an item to appear on the right of the list
-            # The '0' means it will wait indefinitely.
-            message_tuple = redis_client.brpop([INTERACTION_QUEUE_KEY], 0)
-
-            # message_tuple is (b'queue_name', b'message_body')
-            event_data = json.loads(message_tuple[1])
-            print(f"Processing event for user {event_data.get('userId')}")
-            process_interaction_event(db, event_data)
-            # --- END CHANGE ---
+            # BLMPOP waits for the queue to be non-empty, then atomically pops up
+            # to BATCH_SIZE messages from the right. The '0' means it will wait
+            # indefinitely.
+            _, messages = redis_client.blmpop(
+                0, 1, INTERACTION_QUEUE_KEY, direction="RIGHT", count=BATCH_SIZE
+            )
+
+            # Decode messages one by one so a malformed one is parked on its own.
+            events = []
+            undecodable_messages = []
+            for message in messages:
+                try:
+                    events.append(orjson.loads(message))
+                    decoded_messages.append(message)
+                except orjson.JSONDecodeError as e:
+                    print(f"Skipping undecodable message: {e}")
+                    undecodable_messages.append(message)
+            park_messages(undecodable_messages)
+
+            print(f"Processing batch of {len(events)} events")
+            failed_events = process_interaction_events(db, events)
+            decoded_messages = []
+            park_messages([orjson.dumps(event) for event in failed_events])
         except Exception as e:
             print(f"An error occurred: {e}")
-            # In production, you'd have more robust error handling/re-queuing
+            # The batch's transaction was rolled back, so none of its decoded
+            # events were applied; keep them for replay rather than losing them.
+            park_messages(decoded_messages)
             time.sleep(5)
         finally:
             db.close()